@@ -0,0 +1,108 @@
+# _frames.py
+# Векторные конвертеры колонок листа и DataFrame -> строки для бинарного COPY
+# (для синков на pandas; sync_city_parthner без pandas).
+
+import re
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from _pipeline import (INT_TYPES, FLOAT_TYPES, TEXT_TYPES, NUMERIC_TYPES, BOOL_TYPES,
+                       TIMESTAMP_TYPES, NULL_TOKENS, check_types, clean_header)
+
+# чекбоксы Google Sheets экспортируются как TRUE/FALSE, остальное — ручной ввод
+_BOOL_MAP = {
+    "true": True,   "t": True, "1": True, "1.0": True, "yes": True, "y": True, "да": True,  "истина": True,
+    "false": False, "f": False, "0": False, "0.0": False, "no": False, "n": False, "нет": False, "ложь": False,
+}
+
+def clean_headers(cols):
+    return pd.Index([clean_header(c) for c in cols])
+
+def _clean_str(s: pd.Series) -> pd.Series:
+    s = s.astype("string").str.strip()
+    return s.mask(s.str.lower().isin(NULL_TOKENS))  # "none"/"#N/A"/... -> NA одной маской
+
+def _clean_num(s: pd.Series) -> pd.Series:
+    # числа с листа: пробелы/nbsp-разделители разрядов убираем, запятую -> точка
+    return (_clean_str(s).str.replace("\u00a0", "", regex=False)
+                         .str.replace(" ", "", regex=False)
+                         .str.replace(",", ".", regex=False))
+
+_INT_PREFIX_RE = re.compile(r"^([+-]?\d+)")
+
+def vec_to_int(series: pd.Series) -> pd.Series:
+    # Строки -> Int64 целиком по колонке; дробь отбрасываем
+    s = _clean_num(series)
+    num = pd.to_numeric(s, errors="coerce").astype("Float64")
+    # редкие непарсящиеся значения ("12шт", "+12.5руб", "inf") — берём ведущее целое,
+    # тоже векторно, без поэлементного Python-вызова
+    bad = s.notna() & ~np.isfinite(num).fillna(False)
+    if bad.any():
+        lead = s[bad].str.extract(_INT_PREFIX_RE, expand=False)
+        num[bad] = pd.to_numeric(lead, errors="coerce").astype("Float64")
+    return np.trunc(num).astype("Int64")
+
+def vec_to_float(series: pd.Series) -> pd.Series:
+    # Строки -> Float64 целиком по колонке: одна очистка строк и pd.to_numeric, без .map по ячейкам
+    return pd.to_numeric(_clean_num(series), errors="coerce").astype("Float64")
+
+def vec_to_datetime(series: pd.Series) -> pd.Series:
+    # Строки -> datetime64 целиком по колонке (дд.мм.гггг). Формат pandas выводит по первой строке;
+    # строки в другом формате — вторым проходом: сперва ISO (гггг-мм-дд), остальное format="mixed".
+    # ISO отдельно: pandas 3 с dayfirst=True и "mixed" читает 2023-02-01 как 2 января
+    d = pd.to_datetime(series, dayfirst=True, errors="coerce")
+    bad = d.isna() & series.notna()
+    if bad.any():
+        d[bad] = pd.to_datetime(series[bad], format="ISO8601", errors="coerce")
+        bad = d.isna() & series.notna()
+    if bad.any():
+        d[bad] = pd.to_datetime(series[bad], dayfirst=True, format="mixed", errors="coerce")
+    return d
+
+def _to_decimal(s: pd.Series) -> list:
+    # numeric: Decimal из строки, а не через float — без потери точности
+    s = _clean_num(s)
+    ok = np.isfinite(pd.to_numeric(s, errors="coerce").astype("Float64")).fillna(False)
+    return [None if v is None else Decimal(v) for v in s.astype(object).where(ok, None)]
+
+def _to_bool(s: pd.Series, col: str):
+    s = _clean_str(s).str.lower()
+    b = s.map(_BOOL_MAP)
+    unknown = s.notna() & b.isna()
+    if unknown.any():
+        raise ValueError(f"Колонка {col}: не булевы значения {sorted(set(s[unknown]))[:5]}")
+    return b.astype(object).where(b.notna(), None).to_numpy()
+
+def copy_records(df: pd.DataFrame, cols, db_types):
+    # Бинарный COPY требует значений ровно под тип колонки БД:
+    # приводим колонки по data_type и заменяем NA на None (-> NULL)
+    check_types(cols, db_types)
+    out = []
+    for c in cols:
+        s, t = df[c], db_types.get(c)
+        if t in INT_TYPES:
+            s = s.astype("Int64")
+        elif t in FLOAT_TYPES:
+            s = s.astype("Float64")
+        elif t == "date":
+            # na_value=None не трогает NaT в datetime64-колонке (psycopg пишет его как 0001-01-01),
+            # поэтому для дат NA -> None явной маской
+            d = pd.to_datetime(s, errors="coerce")
+            out.append(d.dt.date.astype(object).where(d.notna(), None).to_numpy())
+            continue
+        elif t in TIMESTAMP_TYPES:
+            d = vec_to_datetime(s)
+            out.append(d.astype(object).where(d.notna(), None).to_numpy())  # Timestamp — подкласс datetime
+            continue
+        elif t in NUMERIC_TYPES:
+            out.append(_to_decimal(s))
+            continue
+        elif t in BOOL_TYPES:
+            out.append(_to_bool(s, c))
+            continue
+        elif t in TEXT_TYPES:
+            s = s.astype("string")
+        out.append(s.to_numpy(dtype=object, na_value=None))  # одна конвертация в C
+    return zip(*out)
@@ -0,0 +1,141 @@
+# _pipeline.py
+# Общие шаги всех синков: скачивание листа Google Sheets потоком и загрузка
+# строк в целевую таблицу через TEMP-таблицу с короткой подменой данных.
+
+import io, re, requests, psycopg
+from contextlib import contextmanager
+from psycopg.copy import QueuedLibpqWriter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from _sync_meta import save_meta, conditional_headers
+from _schema_cache import drop_cached_columns
+
+# data_type из information_schema, под которые синки приводят значения
+INT_TYPES   = {"integer", "bigint", "smallint"}
+FLOAT_TYPES = {"double precision", "real"}
+TEXT_TYPES  = {"text", "character varying", "character"}
+NUMERIC_TYPES   = {"numeric"}
+BOOL_TYPES      = {"boolean"}
+TIMESTAMP_TYPES = {"timestamp without time zone"}  # timestamptz не берём: в листе нет часового пояса
+SUPPORTED_TYPES = (INT_TYPES | FLOAT_TYPES | TEXT_TYPES | NUMERIC_TYPES | BOOL_TYPES
+                   | TIMESTAMP_TYPES | {"date"})
+
+def check_types(cols, db_types) -> None:
+    # Бинарный COPY не приводит типы сам: колонку без конвертера лучше отвергнуть до загрузки,
+    # чем упасть посреди COPY или записать мусор
+    bad = [f"{c} ({db_types.get(c)})" for c in cols if db_types.get(c) not in SUPPORTED_TYPES]
+    if bad:
+        raise RuntimeError(f"Нет приведения значений листа для колонок БД: {', '.join(bad)}. "
+                           f"Поддерживаются: {', '.join(sorted(SUPPORTED_TYPES))}")
+
+# значения, которые на листе означают "пусто" — те же NA-токены, что у pandas.read_csv
+# (в нижнем регистре: сравниваем после .lower())
+NULL_TOKENS = frozenset({
+    "", "none", "nan", "-nan", "null", "na", "n/a", "<na>", "#n/a", "#n/a n/a", "#na",
+    "1.#ind", "-1.#ind", "1.#qnan", "-1.#qnan",
+})
+
+_WS_RE = re.compile(r"\s+")  # \s покрывает и \r/\n — отдельная замена переводов строк не нужна
+
+def clean_header(c) -> str:
+    # заголовки листа бывают многострочными: сжимаем пробелы/переводы строк, обрезаем края
+    return _WS_RE.sub(" ", str(c)).strip()
+
+def norm_header(c) -> str:
+    # ключ сравнения заголовка: clean_header + нижний регистр
+    return clean_header(c).lower()
+
+_ID_RE  = re.compile(r"/spreadsheets/d/([^/]+)/")
+_GID_RE = re.compile(r"[?&]gid=(\d+)")
+
+def make_csv_url(u: str) -> str:
+    m_id  = _ID_RE.search(u or "")
+    m_gid = _GID_RE.search(u or "")
+    if not m_id or not m_gid:
+        raise ValueError(f"Bad Google Sheets URL (нужен gid=...). Получено: {u}")
+    return f"https://docs.google.com/spreadsheets/d/{m_id.group(1)}/export?format=csv&gid={m_gid.group(1)}"
+
+# одна HTTP-сессия на процесс: keep-alive между запросами (sync_all.py) и повторы при сетевых сбоях
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "GH Actions sync", "Accept-Encoding": "gzip, deflate"})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
+
+@contextmanager
+def open_sheet(url_ui: str, meta=None, buffer_size: int = io.DEFAULT_BUFFER_SIZE):
+    """Тело CSV-экспорта листа как BufferedReader (поток, без копии в памяти).
+
+    meta: ETag/Last-Modified прошлого синка (см. _sync_meta). При 304 отдаёт None,
+    иначе meta обновляется заголовками нового ответа.
+    """
+    csv_url = make_csv_url(url_ui)
+    print(f"[INFO] CSV export url = {csv_url}")
+    with _SESSION.get(csv_url, timeout=30, stream=True, headers=conditional_headers(meta)) as r:
+        r.raise_for_status()
+        if r.status_code == 304:  # лист не менялся с прошлого синка
+            yield None
+            return
+        if meta is not None:
+            meta.update(etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+        r.raw.decode_content = True
+        r.raw.auto_close = False  # иначе peek() на коротком ответе закроет поток раньше парсера
+        body = io.BufferedReader(r.raw, buffer_size=buffer_size)
+
+        # Если пришёл HTML — лист закрыт/нет доступа (peek не съедает байты)
+        head = body.peek(200)[:200].lower()
+        if b"<html" in head or b"doctype html" in head:
+            raise RuntimeError("Google Sheets вернул HTML вместо CSV. Скорее всего лист приватный или ссылка неверная.")
+        yield body
+
+def load_via_staging(conn, target: str, cols, db_types, rows, meta=None) -> bool:
+    """Бинарный COPY строк в TEMP-таблицу и подмена данных target.
+
+    rows — кортежи значений в порядке cols, уже приведённые под db_types.
+    Возвращает True, если из-за блокировки подмена шла через DELETE, а не TRUNCATE.
+    """
+    table = target.split(".", 1)[-1]
+    cols_sql = ', '.join(f'"{c}"' for c in cols)
+    stg = f"_stg_{table}"
+    check_types(cols, db_types)  # до CREATE/COPY — целевую таблицу не трогаем
+
+    with conn.cursor() as cur:
+        # COPY во временную таблицу (TEMP пишется без WAL и не трогает целевую).
+        # AS SELECT ... WITH NO DATA: только загружаемые колонки с их типами, без NOT NULL/identity
+        # целевой таблицы — ограничения проверит INSERT в target
+        cur.execute(f"CREATE TEMP TABLE {stg} AS SELECT {cols_sql} FROM {target} WITH NO DATA;")
+
+        # типы для бинарного COPY — из только что созданной staging-таблицы, а не из кэша колонок:
+        # при смене типа в пределах TTL кэша энкодер по старому типу молча пишет мусор
+        cur.execute(f"SELECT {cols_sql} FROM {stg} LIMIT 0;")
+        oids = [d.type_code for d in cur.description]
+        cached = [conn.adapters.types.get(db_types[c]) for c in cols]
+        if [t.oid if t else None for t in cached] != oids:
+            drop_cached_columns(*target.split(".", 1))
+            print(f"[WARN] типы колонок {target} разошлись с кэшем схемы — кэш сброшен")
+
+        copy_sql = f"COPY {stg} ({cols_sql}) FROM STDIN WITH (FORMAT BINARY)"
+        # QueuedLibpqWriter: отправка в сокет идёт в фоновом потоке, пока здесь готовятся строки
+        with cur.copy(copy_sql, writer=QueuedLibpqWriter(cur)) as cp:
+            cp.set_types(oids)
+            for row in rows:
+                cp.write_row(row)
+
+        # подмена данных одной короткой транзакцией (мягкая: TRUNCATE → при блоке DELETE):
+        # блокировка держится только на время INSERT ... SELECT, а не всего COPY
+        used_delete = False
+        insert_sql = f"INSERT INTO {target} ({cols_sql}) SELECT {cols_sql} FROM {stg};"
+        try:
+            with conn.transaction():  # LOCK + TRUNCATE + INSERT одним запросом: BEGIN, батч, COMMIT
+                cur.execute(f"LOCK TABLE {target} IN ACCESS EXCLUSIVE MODE NOWAIT; TRUNCATE {target}; {insert_sql}")
+        except psycopg.errors.LockNotAvailable:
+            # таблицу держат читатели — транзакция откатилась целиком (ещё ничего не сделано), идём через DELETE
+            used_delete = True
+            with conn.transaction():
+                cur.execute(f"DELETE FROM {target}; {insert_sql}")
+
+        # после TRUNCATE/DELETE + INSERT статистика планировщика устарела — обновляем сразу,
+        # не дожидаясь autovacuum (ANALYZE не блокирует читателей)
+        cur.execute(f"ANALYZE {target};")
+    save_meta(conn, target, meta)  # только после успешной подмены
+    return used_delete
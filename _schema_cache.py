@@ -0,0 +1,44 @@
+# _schema_cache.py
+# Кэш списка колонок таблицы из information_schema.columns между запусками:
+# схема меняется редко, а запрос к information_schema — лишний round-trip.
+
+import os, json, time, tempfile
+
+# Сколько минут кэш считается свежим (0 — всегда ходить в БД)
+CACHE_TTL_MIN = int(os.environ.get("COLS_CACHE_TTL_MIN") or 60)
+
+def _cache_path(schema: str, table: str) -> str:
+    return os.path.join(tempfile.gettempdir(), f"colscache-{schema}.{table}.json")
+
+def get_db_columns(cur, schema: str, table: str) -> list:
+    """[(column_name, data_type), ...] в порядке ordinal_position."""
+    path = _cache_path(schema, table)
+    try:
+        if CACHE_TTL_MIN > 0 and time.time() - os.path.getmtime(path) < CACHE_TTL_MIN * 60:
+            with open(path, encoding="utf-8") as f:
+                return [tuple(r) for r in json.load(f)]
+    except (OSError, ValueError):
+        pass  # нет кэша или он битый — читаем из БД
+
+    cur.execute("""
+      SELECT column_name, data_type
+      FROM information_schema.columns
+      WHERE table_schema=%s AND table_name=%s
+      ORDER BY ordinal_position
+    """, (schema, table))
+    cols = [tuple(r) for r in cur.fetchall()]
+
+    # пустой результат (нет таблицы/доступа) не кэшируем
+    if cols and CACHE_TTL_MIN > 0:
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cols, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    return cols
+
+def drop_cached_columns(schema: str, table: str) -> None:
+    # кэш разошёлся со схемой (например, сменили тип колонки) — следующий запуск перечитает её из БД
+    try:
+        os.remove(_cache_path(schema, table))
+    except OSError:
+        pass
@@ -0,0 +1,49 @@
+# _sync_meta.py
+# ETag/Last-Modified листа с прошлого успешного синка. Если Google отвечает 304,
+# синк выходит сразу: лист не скачивается и целевая таблица не трогается.
+#
+# Таблица создаётся один раз вручную:
+#   CREATE TABLE hr.sync_meta (
+#       table_name    text PRIMARY KEY,
+#       etag          text,
+#       last_modified text,
+#       updated_at    timestamptz NOT NULL DEFAULT now()
+#   );
+
+import os, psycopg
+
+META_TABLE = os.environ.get("SYNC_META_TABLE") or "hr.sync_meta"
+
+def load_meta(conn, table_name: str) -> dict:
+    """{"etag": ..., "last_modified": ...} с прошлого синка; {} если записи/таблицы нет."""
+    try:
+        row = conn.execute(
+            f"SELECT etag, last_modified FROM {META_TABLE} WHERE table_name=%s", (table_name,)
+        ).fetchone()
+    except psycopg.errors.UndefinedTable:
+        print(f"[WARN] {META_TABLE} не найдена — проверка ETag отключена")
+        return {}
+    return {"etag": row[0], "last_modified": row[1]} if row else {}
+
+def conditional_headers(meta) -> dict:
+    # If-None-Match/If-Modified-Since из прошлого ответа -> сервер может вернуть 304
+    h = {}
+    if meta and meta.get("etag"):
+        h["If-None-Match"] = meta["etag"]
+    if meta and meta.get("last_modified"):
+        h["If-Modified-Since"] = meta["last_modified"]
+    return h
+
+def save_meta(conn, table_name: str, meta) -> None:
+    # вызывается только после успешной подмены данных
+    if not meta or not (meta.get("etag") or meta.get("last_modified")):
+        return
+    try:
+        conn.execute(f"""
+          INSERT INTO {META_TABLE} (table_name, etag, last_modified, updated_at)
+          VALUES (%s, %s, %s, now())
+          ON CONFLICT (table_name) DO UPDATE
+             SET etag=EXCLUDED.etag, last_modified=EXCLUDED.last_modified, updated_at=now()
+        """, (table_name, meta.get("etag"), meta.get("last_modified")))
+    except psycopg.errors.UndefinedTable:
+        pass  # предупреждение уже было в load_meta
@@ -0,0 +1,39 @@
+# db.py
+# Общий пул подключений к Postgres. Когда синки идут в одном процессе (sync_all.py),
+# TCP+TLS+auth делается один раз на соединение пула, а не на каждый синк;
+# при одиночном запуске это обычное соединение с теми же настройками.
+
+import os, atexit, threading
+from contextlib import contextmanager
+from psycopg_pool import ConnectionPool
+
+DATABASE_URL = os.environ["DATABASE_URL"]   # из GitHub Secrets
+
+POOL = ConnectionPool(
+    DATABASE_URL,
+    min_size=1,
+    max_size=4,   # по соединению на каждый синк из sync_all.py
+    kwargs={
+        "autocommit": True,  # транзакции задаём явно через conn.transaction()
+        "connect_timeout": 10,
+        "options": "-c lock_timeout=5000 -c statement_timeout=120000",
+        # без серверных prepared statements: DISCARD ALL в reset их удаляет, а psycopg
+        # после 5 повторов запроса на соединении продолжает ссылаться на "_pg3_N"
+        "prepare_threshold": None,
+    },
+    # при возврате в пул чистим сессию: TEMP-таблицы, application_name и т.п.
+    reset=lambda conn: conn.execute("DISCARD ALL"),
+    open=False,
+)
+_open_lock = threading.Lock()
+
+@contextmanager
+def connection(app_name: str):
+    """Соединение из пула; app_name виден в pg_stat_activity как application_name."""
+    with _open_lock:
+        if POOL.closed:
+            POOL.open()
+            atexit.register(POOL.close)
+    with POOL.connection() as conn:
+        conn.execute("SELECT set_config('application_name', %s, false)", (app_name,))
+        yield conn
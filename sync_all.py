@@ -0,0 +1,44 @@
+# sync_all.py
+# Все синки одним процессом и параллельно: скачивание листов и COPY у каждого
+# синка — сетевое ожидание, поэтому общее время ≈ самому долгому синку, а не сумме.
+
+import os, asyncio, importlib
+
+# модуль синка -> переменная окружения со ссылкой на его лист
+JOBS = {
+    "sync_hr": "SHEET_URL",
+    "sync_cities": "CITIES_SHEET_URL",
+    "sync_city_parthner": "CITIES_PARTHNER_SHEET_URL",
+    "sync_kf_type_rk": "KF_TYPE_RK",
+}
+
+async def run_all() -> int:
+    names = [m for m, env in JOBS.items() if os.environ.get(env)]
+    for m, env in JOBS.items():
+        if m not in names:
+            print(f"[SKIP] {m}: {env} не задан")
+    if not names:
+        raise RuntimeError(f"Не задан ни один лист. Нужна хотя бы одна из: {list(JOBS.values())}")
+
+    # main() каждого синка блокирующий (requests/psycopg) — гоняем их в потоках;
+    # GIL отпускается на сетевом I/O, так что загрузки и COPY идут одновременно
+    mods = [importlib.import_module(m) for m in names]
+    results = await asyncio.gather(
+        *(asyncio.to_thread(mod.main) for mod in mods),
+        return_exceptions=True,
+    )
+
+    failed = 0
+    for name, res in zip(names, results):
+        if isinstance(res, BaseException):
+            failed += 1
+            print(f"[ERROR] {name}: {res!r}")
+    return failed
+
+def main():
+    failed = asyncio.run(run_all())
+    if failed:
+        raise SystemExit(f"{failed} sync(s) failed")
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,50 @@
 # sync_hr.py
-import os, io, re, requests, psycopg2
+import os, io, csv
 import pandas as pd
-import numpy as np
+
+from _schema_cache import get_db_columns
+from db import connection
+from _sync_meta import load_meta
+from _pipeline import open_sheet, load_via_staging, norm_header
+from _frames import copy_records, clean_headers, vec_to_int, vec_to_datetime
 
 # В секретах укажи ссылку на лист "Численность РИМ" (gid=0)
 SHEET_URL    = os.environ.get("SHEET_URL")     # из GitHub Secrets, например: .../edit?gid=0#gid=0
-DATABASE_URL = os.environ["DATABASE_URL"]      # из GitHub Secrets
 TARGET_TABLE = "analytics.hr_employees"        # целевая таблица в БД
 
-def make_csv_url(u: str) -> str:
-    m_id  = re.search(r"/spreadsheets/d/([^/]+)/", u)
-    m_gid = re.search(r"[?&]gid=(\d+)", u)
-    if not m_id or not m_gid:
-        raise ValueError("Bad Google Sheets URL (need gid=...)")
-    return f"https://docs.google.com/spreadsheets/d/{m_id.group(1)}/export?format=csv&gid={m_gid.group(1)}"
-
-def get_csv_df(url: str) -> pd.DataFrame:
-    r = requests.get(make_csv_url(url), timeout=30, headers={"User-Agent":"GH Actions sync"})
-    r.raise_for_status()
-    return pd.read_csv(io.BytesIO(r.content), encoding="utf-8")
-
-def clean_headers(cols):
-    # Убираем \r/\n, сжимаем пробелы, обрезаем по краям
-    return (pd.Index(cols)
-              .astype(str)
-              .str.replace(r"[\r\n]+", " ", regex=True)
-              .str.replace(r"\s+", " ", regex=True)
-              .str.strip())
-
-def to_date_iso(v):
-    if v is None or v == "": return None
-    d = pd.to_datetime(v, dayfirst=True, errors="coerce")
-    return None if pd.isna(d) else d.strftime("%Y-%m-%d")
-
-def to_int_or_none(v):
-    if v is None or (isinstance(v, float) and np.isnan(v)): return None
-    s = str(v).strip().replace("\u00a0","")
-    if s == "" or s.lower() in ("none","nan"): return None
-    s = s.replace(" ", "").replace(",", ".")
-    try:
-        f = float(s)
-        if np.isnan(f): return None
-        return int(f)
-    except:
-        m = re.match(r"^\s*([+-]?\d+)", s)
-        return int(m.group(1)) if m else None
-
-# Русские -> английские имена после «склейки» заголовков
+_HEAD_PEEK = 1 << 16  # заголовок листа с запасом влезает в 64 КБ
+
+def get_csv_df(url_ui: str, usecols=None, meta=None):
+    # meta: ETag/Last-Modified прошлого синка; при 304 -> None (см. _pipeline.open_sheet).
+    # usecols: нормализованные (norm_header) имена нужных колонок, остальные парсер пропускает
+    with open_sheet(url_ui, meta, buffer_size=_HEAD_PEEK) as body:
+        if body is None:
+            return None
+        # pyarrow не принимает callable в usecols — сырые имена берём из заголовка,
+        # подсмотренного через peek (поток при этом не расходуется)
+        if usecols:
+            usecols = _header_usecols(body.peek(_HEAD_PEEK), usecols)
+        # pyarrow: многопоточный CSV-парсер; лист HR — самый широкий и длинный из всех
+        return pd.read_csv(body, encoding="utf-8", engine="pyarrow", usecols=usecols)
+
+def _header_usecols(head: bytes, wanted):
+    # Сырые имена колонок, чьи norm_header-имена входят в wanted; None — читать все колонки
+    rows = csv.reader(io.StringIO(head.decode("utf-8", errors="ignore")))
+    header = next(rows, None)
+    if header is None or next(rows, None) is None:
+        return None  # заголовок мог не влезть в буфер целиком — не рискуем потерять колонки
+    picked = list(dict.fromkeys(c for c in header if norm_header(c) in wanted))
+    return picked or None
+
+# Русские -> английские имена после «склейки» заголовков (регистр не важен, см. _RENAME_NORM)
 RENAME_MAP = {
     '№ авто':'row_no',
-    'фио':'full_name','ФИО':'full_name',
+    'ФИО':'full_name',
     'Статус работы':'job_status',
     'Юр лицо':'legal_entity',
-    'город':'city','Город':'city',
+    'Город':'city',
     'Подразделение (из штата)':'department_staff',
-    'должность':'position','Должность':'position',
+    'Должность':'position',
 
     # даты
     'дата выхода на работу ПЛАН':'start_date_plan',
@@ -65,8 +55,8 @@ RENAME_MAP = {
     # флаги/описания
     'Оффер отклонен':'offer_rejected',
     'Формат велкома':'welcome_format',
-    'тренер':'trainer','Тренер':'trainer',
-    'hr':'hr_manager','HR':'hr_manager',
+    'Тренер':'trainer',
+    'HR':'hr_manager',
     'Источник найма':'hire_source',
     'ФИО реферальный':'referral_name',
     'Непосредственный руководитель':'direct_manager',
@@ -77,8 +67,8 @@ RENAME_MAP = {
     'Стаж на СЕГОДНЯ или дату увольнения':'seniority_today_or_term',
 
     # обучение/адаптация
-    'адаптация':'adaptation','Адаптация':'adaptation',
-    'обучение':'training','Обучение':'training',
+    'Адаптация':'adaptation',
+    'Обучение':'training',
 
     'Причина отказа от оффера':'offer_rejection_reason',
     'Причина ухода':'resignation_reason',
@@ -114,89 +104,62 @@ RENAME_MAP = {
     'Отдел продаж':'sales_department',
 }
 
+# строится один раз при импорте; lookup по norm_header(заголовка)
+_RENAME_NORM = {norm_header(k): v for k, v in RENAME_MAP.items()}
+
 def main():
-    # 1) читаем лист
     if not SHEET_URL:
         raise RuntimeError("SHEET_URL is not set. Put your Google Sheets link with gid=... into GitHub Secrets.")
-    df_raw = get_csv_df(SHEET_URL)
-    df = df_raw.copy()
-    df.columns = clean_headers(df.columns)
 
-    # 2) схема БД
+    # 1) схема БД и ETag/Last-Modified прошлого синка (если лист не менялся, выходим без загрузки)
     schema, table = TARGET_TABLE.split('.', 1)
-    conn = psycopg2.connect(
-        DATABASE_URL,
-        connect_timeout=10,
-        options="-c lock_timeout=5000 -c statement_timeout=120000 -c application_name=gh_hr_sync"
-    )
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT column_name, data_type
-      FROM information_schema.columns
-      WHERE table_schema=%s AND table_name=%s
-      ORDER BY ordinal_position
-    """, (schema, table))
-    cols_db = cur.fetchall()
+    with connection("gh_hr_sync") as conn, conn.cursor() as cur:
+        meta = load_meta(conn, TARGET_TABLE)
+        cols_db = get_db_columns(cur, schema, table)
     if not cols_db:
         raise RuntimeError(f"Table {TARGET_TABLE} not found or no access.")
     db_types = {c: t for c, t in cols_db}
     db_cols_order = [c for c, _ in cols_db]
 
+    # 2) читаем лист — только колонки, которые есть в БД или в RENAME_MAP
+    wanted = set(_RENAME_NORM) | {norm_header(c) for c in db_cols_order}
+    df = get_csv_df(SHEET_URL, usecols=wanted, meta=meta)  # свежий DataFrame, копия не нужна
+    if df is None:
+        print(f"SKIP | sheet not modified (304) | target={TARGET_TABLE}")
+        return
+    df.columns = clean_headers(df.columns)
+    # pyarrow не переименовывает дубли заголовков (как "x.1" у C-парсера) — оставляем первый
+    df = df.loc[:, ~df.columns.duplicated()]
+
     # 3) построение маппинга колонок (пересечение по имени + карта RENAME_MAP)
     present = {}
     for col in df.columns:
         if col in db_cols_order:
             present[col] = col
-        elif col in RENAME_MAP:
-            present[col] = RENAME_MAP[col]
+        elif (name := _RENAME_NORM.get(norm_header(col))):
+            present[col] = name
     keep = [c for c in df.columns if c in present]
     if not keep:
         raise RuntimeError("No columns matched between sheet headers and DB schema/RENAME_MAP.")
-    df = df[keep].rename(columns=present).copy()
+    df = df[keep].rename(columns=present)  # rename уже возвращает новый DataFrame
 
     # 4) приведение типов под схему БД
     for c, t in db_types.items():
         if c in df.columns and t == 'date':
-            df[c] = df[c].map(to_date_iso)
+            df[c] = vec_to_datetime(df[c])
     for c, t in db_types.items():
         if c in df.columns and t in {'integer','bigint','smallint'}:
-            df[c] = df[c].map(to_int_or_none).astype("Int64")
+            df[c] = vec_to_int(df[c])
 
     # итоговая последовательность колонок — как в БД, без updated_at
     load_cols = [c for c in db_cols_order if c in df.columns and c != 'updated_at']
     if not load_cols:
         raise RuntimeError("No common columns after mapping (after excluding updated_at).")
 
-    # 5) соберём CSV-буфер для COPY
-    buf = io.StringIO()
-    df[load_cols].to_csv(buf, index=False)
-    buf.seek(0)
-
-    # 6) очистка и COPY
-    used_delete = False
-    try:
-        cur.execute("BEGIN;")
-        cur.execute(f"LOCK TABLE {TARGET_TABLE} IN ACCESS EXCLUSIVE MODE NOWAIT;")
-        cur.execute(f"TRUNCATE {TARGET_TABLE};")
-        cur.execute("COMMIT;")
-    except Exception:
-        conn.rollback()
-        used_delete = True
-        cur.execute("BEGIN;")
-        cur.execute(f"DELETE FROM {TARGET_TABLE};")
-        cur.execute("COMMIT;")
-
-    cur = conn.cursor()
-    cur.execute("BEGIN;")
-    
-    # ИСПРАВЛЕНИЕ: заключаем имена колонок в двойные кавычки
-    quoted_cols = [f'"{col}"' for col in load_cols]
-    copy_sql = f"COPY {TARGET_TABLE} ({', '.join(quoted_cols)}) FROM STDIN WITH CSV HEADER ENCODING 'UTF8'"
-    
-    cur.copy_expert(copy_sql, buf)
-    cur.execute("COMMIT;")
-    cur.close()
-    conn.close()
+    # 5-7) бинарный COPY во временную таблицу и подмена данных (см. _pipeline)
+    records = copy_records(df, load_cols, db_types)
+    with connection("gh_hr_sync") as conn:
+        used_delete = load_via_staging(conn, TARGET_TABLE, load_cols, db_types, records, meta)
 
     print(f"OK | rows={len(df)} | cols={len(load_cols)} | mode={'DELETE' if used_delete else 'TRUNCATE'}")
 
@@ -0,0 +1,44 @@
+# tests/test_frames.py
+# Проверки приведения DataFrame -> строки для бинарного COPY (без БД и сети).
+
+import os, sys, datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _frames import copy_records, vec_to_int, vec_to_float, vec_to_datetime
+
+def test_all_na_date_column_gives_none():
+    # вся колонка пустая -> datetime64 из одних NaT; в COPY должен уйти NULL, а не 0001-01-01
+    df = pd.DataFrame({"d": [None, None]})
+    assert list(copy_records(df, ["d"], {"d": "date"})) == [(None,), (None,)]
+
+def test_date_column_mixed_na():
+    df = pd.DataFrame({"d": pd.to_datetime(pd.Series(["2024-01-02", None]))})
+    assert list(copy_records(df, ["d"], {"d": "date"})) == [(datetime.date(2024, 1, 2),), (None,)]
+
+def test_numeric_bool_timestamp():
+    df = pd.DataFrame({"n": ["1 200,50", "abc", None], "b": ["TRUE", "нет", ""],
+                       "t": ["31.12.2024 10:00", "01.02.2023 00:00:01", None]})
+    types = {"n": "numeric", "b": "boolean", "t": "timestamp without time zone"}
+    assert list(copy_records(df, list(types), types)) == [
+        (Decimal("1200.50"), True, datetime.datetime(2024, 12, 31, 10, 0)),
+        (None, False, datetime.datetime(2023, 2, 1, 0, 0, 1)),
+        (None, None, None),
+    ]
+
+def test_unknown_bool_and_unsupported_type_raise():
+    with pytest.raises(ValueError):
+        copy_records(pd.DataFrame({"b": ["maybe"]}), ["b"], {"b": "boolean"})
+    with pytest.raises(RuntimeError):
+        copy_records(pd.DataFrame({"t": ["x"]}), ["t"], {"t": "timestamp with time zone"})
+
+def test_vec_converters():
+    s = pd.Series(["1 200,7", "12шт", "#N/A", None])
+    assert vec_to_int(s).tolist() == [1200, 12, pd.NA, pd.NA]
+    assert vec_to_float(s).tolist()[:1] == [1200.7]
+    d = vec_to_datetime(pd.Series(["31.12.2024", "2023-02-01", None]))
+    assert d.dt.date.tolist()[:2] == [datetime.date(2024, 12, 31), datetime.date(2023, 2, 1)]